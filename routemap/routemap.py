@@ -7,13 +7,17 @@ import math
 import warnings
 import sys
 import datetime
+import struct
+import zipfile
 import requests
 import xml.etree.ElementTree as etree
 
-from vincenty import vincenty
+import numpy as np
 from geographiclib.geodesic import Geodesic, Constants
 from mpl_toolkits.basemap import Basemap
 import matplotlib
+from matplotlib.collections import LineCollection
+from matplotlib.patches import Polygon
 
 from routemap import __version__ as version
 
@@ -29,9 +33,41 @@ except ImportError:
 if tk is False:
     matplotlib.use('AGG')
 
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
 import matplotlib.pyplot as plt
 
 KM_IN_NM = 1.852
+# WGS84 ellipsoid, as used by the vincenty package
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = 6356752.314245
+# Readers for each input format, keyed by file suffix, see register_reader.
+READERS = {}
+# Anything drawn below this zorder is merged into a single image when the
+# background is rasterised for vector output.
+BACKGROUND_ZORDER = 0
+# Output formats where the background can be rasterised under vector lines.
+VECTOR_FORMATS = ['svg', 'pdf', 'eps', 'ps']
+# Offsets, in points, tried in turn when placing a label next to its position.
+LABEL_OFFSETS = [
+    (offset * dx, offset * dy)
+    for offset in (8, 24)
+    for dx, dy in ((1, 1), (-1, 1), (1, -1), (-1, -1),
+                   (0, 1), (0, -1), (1, 0), (-1, 0))
+]
+# Size, in pixels, of the grid cells used to look up placed labels.
+LABEL_CELL_SIZE = 32
+# Legend locations tried in turn, before falling back to 'best'.
+LEGEND_LOCATIONS = ['upper right', 'upper left', 'lower left', 'lower right']
+# Coastline store layout, see build_store.
+STORE_VERSION = 3
+STORE_HEADER = 8
+STORE_TILE_SIZE = 5
+STORE_COAST, STORE_LAND, STORE_LAKE = 0, 1, 2
 cli = False
 
 
@@ -85,23 +121,354 @@ def calcdistance(latitudes, longitudes):
     :type latitudes: list
     :param longitudes:
     :type longitudes: list
-    :return:
+    :return: The distance in km
     :rtype: float
     """
-    positions = []
-    distances = []
+    return float(np.sum(vincenty_distances(latitudes, longitudes)))
+
+
+def vincenty_distances(latitudes, longitudes, iterations=200):
+    """
+    Calculate the distance of each leg of the route with Vincenty's
+    inverse formula, working on every leg at once. Gives the same results
+    as the vincenty package, legs that fail to converge are NaN.
+
+    :param latitudes:
+    :type latitudes: list
+    :param longitudes:
+    :type longitudes: list
+    :param iterations: Give up on legs that haven't converged after this
+    :type iterations: int
+    :return: The distance of each leg in km
+    :rtype: numpy.ndarray
+    """
+    lats = np.radians(np.asarray(latitudes, dtype=float))
+    lons = np.radians(np.asarray(longitudes, dtype=float))
+    u1 = np.arctan((1 - WGS84_F) * np.tan(lats[:-1]))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(lats[1:]))
+    sinu1, cosu1 = np.sin(u1), np.cos(u1)
+    sinu2, cosu2 = np.sin(u2), np.cos(u2)
+    diff = np.diff(lons)
+    lam = diff.copy()
+
+    # Each leg keeps the values from the iteration it converged on, as it
+    # would if it were calculated on its own.
+    active = np.ones(len(diff), dtype=bool)
+    sinsigma, cossigma, sigma, cossqalpha, cos2sigmam = np.zeros(
+            (5, len(diff)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            sinlam, coslam = np.sin(lam), np.cos(lam)
+            np.copyto(sinsigma, np.hypot(
+                    cosu2 * sinlam, cosu1 * sinu2 - sinu1 * cosu2 * coslam),
+                      where=active)
+            np.copyto(cossigma, sinu1 * sinu2 + cosu1 * cosu2 * coslam,
+                      where=active)
+            np.copyto(sigma, np.arctan2(sinsigma, cossigma), where=active)
+            sinalpha = cosu1 * cosu2 * sinlam / sinsigma
+            np.copyto(cossqalpha, 1 - sinalpha ** 2, where=active)
+            np.copyto(cos2sigmam, np.where(
+                    cossqalpha != 0,
+                    cossigma - 2 * sinu1 * sinu2 / cossqalpha, 0),
+                      where=active)
+            c = WGS84_F / 16 * cossqalpha * (4 + WGS84_F * (
+                    4 - 3 * cossqalpha))
+            following = diff + (1 - c) * WGS84_F * sinalpha * (
+                    sigma + c * sinsigma * (cos2sigmam + c * cossigma * (
+                            -1 + 2 * cos2sigmam ** 2)))
+            converged = ~(np.abs(following - lam) >= 1e-12)
+            lam = np.where(active, following, lam)
+            active &= ~converged
+            if not active.any():
+                break
+
+        usq = cossqalpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        a = 1 + usq / 16384 * (4096 + usq * (-768 + usq * (
+                320 - 175 * usq)))
+        b = usq / 1024 * (256 + usq * (-128 + usq * (74 - 47 * usq)))
+        deltasigma = b * sinsigma * (cos2sigmam + b / 4 * (
+                cossigma * (-1 + 2 * cos2sigmam ** 2) -
+                b / 6 * cos2sigmam * (-3 + 4 * sinsigma ** 2) *
+                (-3 + 4 * cos2sigmam ** 2)))
+        distances = np.round(WGS84_B * a * (sigma - deltasigma) / 1000, 6)
+
+    distances[sinsigma == 0] = 0
+    distances[active] = np.nan
+
+    return distances
+
+
+def leg_speeds(latitudes, longitudes, times):
+    """
+    Calculate the speed made good on each leg of the route.
+    Legs that take no time have a speed of NaN.
+
+    :param latitudes:
+    :type latitudes: list
+    :param longitudes:
+    :type longitudes: list
+    :param times:
+    :type times: numpy.ndarray
+    :return: The speed of each leg in knots
+    :rtype: numpy.ndarray
+    """
+    distances = vincenty_distances(latitudes, longitudes) / KM_IN_NM
+    hours = np.diff(times) / np.timedelta64(1, 'h')
+
+    return np.divide(distances, hours, out=np.full_like(distances, np.nan),
+                     where=hours > 0)
+
+
+def time_at_sea(latitudes, longitudes, times):
+    """
+    Calculate the time spent under way, ie the duration of every
+    leg that covers some distance.
+
+    :param latitudes:
+    :type latitudes: list
+    :param longitudes:
+    :type longitudes: list
+    :param times:
+    :type times: numpy.ndarray
+    :return: The time at sea
+    :rtype: numpy.timedelta64
+    """
+    moving = vincenty_distances(latitudes, longitudes) != 0
+
+    return np.diff(times)[moving].sum().astype('timedelta64[s]')
+
+
+def average_speed(latitudes, longitudes, times):
+    """
+    Calculate the average speed while at sea.
+
+    :param latitudes:
+    :type latitudes: list
+    :param longitudes:
+    :type longitudes: list
+    :param times:
+    :type times: numpy.ndarray
+    :return: The average speed in knots, NaN if no time was spent at sea
+    :rtype: float
+    """
+    distance = np.nansum(vincenty_distances(latitudes, longitudes)) / KM_IN_NM
+    hours = time_at_sea(latitudes, longitudes, times) / np.timedelta64(1, 'h')
+
+    return distance / hours if hours > 0 else float('nan')
+
+
+def format_duration(duration):
+    """
+    Format a duration as days and hours, to the nearest hour
+
+    :param duration:
+    :type duration: numpy.timedelta64
+    :return: eg '2d 05h'
+    :rtype: str
+    """
+    days, hours = divmod(int(round(duration / np.timedelta64(1, 'h'))), 24)
+
+    return '{}d {:02}h'.format(days, hours)
+
+
+def get_eta(latitudes, longitudes, times, upto=None,
+            recent=np.timedelta64(6, 'h')):
+    """
+    Estimate the time of arrival at the final waypoint from the
+    speed made good over the recent part of the track.
+
+    :param latitudes:
+    :type latitudes: list
+    :param longitudes:
+    :type longitudes: list
+    :param times:
+    :type times: numpy.ndarray
+    :param upto: Index of the last position reached, defaults to the last
+    :type upto: int
+    :param recent: How far back to look when calculating the speed, at
+                   least the last leg is always used
+    :type recent: numpy.timedelta64
+    :return: The ETA, NaT if no recent speed is available
+    :rtype: numpy.datetime64
+    """
+    if upto is None:
+        upto = len(times) - 1
+
+    distances = vincenty_distances(latitudes, longitudes) / KM_IN_NM
+    remaining = np.nansum(distances[upto:])
+    start = np.searchsorted(times[:upto + 1], times[upto] - recent)
+    if upto > 0:
+        start = min(start, upto - 1)
+    hours = (times[upto] - times[start]) / np.timedelta64(1, 'h')
+    speed = np.nansum(distances[start:upto]) / hours if hours > 0 else 0
+
+    if remaining == 0:
+        return times[upto]
+    if speed <= 0:
+        return np.datetime64('NaT')
+
+    return times[upto] + np.timedelta64(int(round(remaining / speed * 3600)),
+                                        's')
+
+
+def get_window(times, start=None, end=None):
+    """
+    Find the part of a track that falls inside a time window.
+    The times must be in order, ValueError is raised if they aren't.
+
+    :param times:
+    :type times: numpy.ndarray
+    :param start: Start of the window, defaults to the start of the track
+    :type start: numpy.datetime64
+    :param end: End of the window, defaults to the end of the track
+    :type end: numpy.datetime64
+    :return: A slice to apply to the track arrays
+    :rtype: slice
+    """
+    if np.any(np.diff(times) < np.timedelta64(0)):
+        raise ValueError('Times must be in order to take a window')
+
+    first = 0 if start is None else np.searchsorted(times, start, 'left')
+    last = len(times) if end is None else np.searchsorted(times, end, 'right')
+
+    return slice(int(first), int(last))
+
+
+def get_annotation_indexes(lons, lats, annotations):
+    """
+    Find the position on the track that each annotation belongs to, ie
+    the nearest one.
+
+    :param lons:
+    :type lons: numpy.ndarray
+    :param lats:
+    :type lats: numpy.ndarray
+    :param annotations:
+    :type annotations: list
+    :return: An index into the track for each annotation
+    :rtype: list
+    """
+    return [
+        int(np.argmin((lons - annot[0]) ** 2 + (lats - annot[1]) ** 2))
+        for annot in annotations
+    ]
+
+
+def simplify(x, y, tolerance):
+    """
+    Simplify a line with the Douglas-Peucker algorithm.
+
+    :param x:
+    :type x: numpy.ndarray
+    :param y:
+    :type y: numpy.ndarray
+    :param tolerance: Drop points closer than this to the simplified line
+    :type tolerance: float
+    :return: A mask of the points to keep
+    :rtype: numpy.ndarray
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+
+    stack = [(0, len(x) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        dx = x[last] - x[first]
+        dy = y[last] - y[first]
+        px = x[first + 1:last] - x[first]
+        py = y[first + 1:last] - y[first]
+        length = math.hypot(dx, dy)
+        if length > 0:
+            offsets = np.abs(dx * py - dy * px) / length
+        else:
+            offsets = np.hypot(px, py)
+
+        furthest = int(np.argmax(offsets))
+        if offsets[furthest] > tolerance:
+            furthest += first + 1
+            keep[furthest] = True
+            stack.append((first, furthest))
+            stack.append((furthest, last))
 
-    i = 0
-    while i < len(latitudes):
-        positions.append((latitudes[i], longitudes[i]))
-        i += 1
+    return keep
 
-    i = 0
-    while i < len(positions) - 1:
-        distances.append(vincenty(positions[i], positions[i + 1]))
-        i += 1
 
-    return sum(distances)
+class Route:
+    """
+    The positions, annotations and times of a route, with the projected
+    positions kept once the route has been projected so simplifying,
+    drawing and labelling all use the same arrays. keep marks the
+    projected positions left once the route has been simplified.
+    """
+
+    def __init__(self, lons, lats, annotations, times=None):
+        self.lons = np.asarray(lons, dtype=float)
+        self.lats = np.asarray(lats, dtype=float)
+        self.annotations = annotations
+        self.times = times
+        self.projection = None
+        self.x = self.y = None
+        self.annotx = self.annoty = None
+        self.keep = None
+        self.tolerance = None
+
+    def project(self, m):
+        """
+        Project the route and its annotations with a single call to m.
+        The result is cached until the route is projected with another m.
+        :param m:
+        :type m: Basemap
+        :return: The route
+        :rtype: Route
+        """
+        if self.projection is not m:
+            x, y = m(
+                    np.concatenate((self.lons, np.array(
+                            [annot[0] for annot in self.annotations],
+                            dtype=float))),
+                    np.concatenate((self.lats, np.array(
+                            [annot[1] for annot in self.annotations],
+                            dtype=float)))
+            )
+            count = len(self.lons)
+            self.x, self.annotx = x[:count], x[count:]
+            self.y, self.annoty = y[:count], y[count:]
+            self.projection = m
+            self.keep = None
+
+        return self
+
+    def simplify(self, tolerance):
+        """
+        Simplify the projected route, see simplify. The result is cached
+        until the route is simplified with another tolerance or projected
+        again.
+        :param tolerance: In projected units
+        :type tolerance: float
+        :return: The route
+        :rtype: Route
+        """
+        if self.keep is None or self.tolerance != tolerance:
+            self.keep = simplify(self.x, self.y, tolerance)
+            self.tolerance = tolerance
+
+        return self
+
+    def simplified(self):
+        """
+        The projected route as drawn, simplified if it has been
+        :return: x and y
+        :rtype: tuple
+        """
+        if self.keep is None:
+            return self.x, self.y
+
+        return self.x[self.keep], self.y[self.keep]
 
 
 def parsertx(rtx):
@@ -109,7 +476,7 @@ def parsertx(rtx):
     Parse a rtx file
     :param rtx:
     :type rtx: str
-    :return: a list of positions and annotations
+    :return: a list of positions, annotations and times
     :rtype: list
     """
     routexml = etree.fromstring(rtx)
@@ -131,7 +498,7 @@ def parsertx(rtx):
             lats.append(pos_to_float(lat))
             lons.append(pos_to_float(lon))
 
-    return [lons, lats, annots]
+    return [lons, lats, annots, None]
 
 
 def get_gc_positions(start, end):
@@ -163,7 +530,8 @@ def get_gc_positions(start, end):
         result = gc.Position(s, Geodesic.STANDARD | Geodesic.LONG_UNROLL)
         position = {
             'Lat': result['lat2'],
-            'Lon': result['lon2']
+            'Lon': result['lon2'],
+            'Dist': s
         }
         positions.append(position)
 
@@ -175,34 +543,46 @@ def parsebvs(bvs):
     Parse a bvs file
     :param bvs:
     :type bvs: str
-    :return: a list of positions and annotations
+    :return: a list of positions, annotations and times
     :rtype: list
     """
     lats = []
     lons = []
     annots = []
+    times = []
 
     xml = etree.fromstring(bvs).find('TrackInfo')
     positions = xml.findall('Position')
+    dates = [
+        datetime.datetime.strptime(position.get('Date'),
+                                   '%Y-%m-%dT%H:%M:%S-00:00')
+        for position in positions
+    ]
     for i, position in enumerate(positions):
         if position.get('Navigation') == 'GC':
-            for gc_pos in get_gc_positions(
+            gc_positions = get_gc_positions(
                     (float(position.get('Lat')), float(position.get('Lon'))),
                     (
                             float(positions[i + 1].get('Lat')),
                             float(positions[i + 1].get('Lon'))
                     ),
-            ):
+            )
+            # Intermediate GC positions have no time of their own, so
+            # interpolate by distance along the great circle.
+            gc_distance = gc_positions[-1]['Dist'] or 1
+            for gc_pos in gc_positions:
                 lats.append(gc_pos['Lat'])
                 lons.append(gc_pos['Lon'])
+                times.append(dates[i] + (dates[i + 1] - dates[i]) *
+                             (gc_pos['Dist'] / gc_distance))
         else:
             lats.append(float(position.get('Lat')))
             lons.append(float(position.get('Lon')))
+            times.append(dates[i])
 
         if position.get('Type') in ['BR', 'ER']:
             name = position.get('Name').title()
-            calldate = datetime.datetime.strptime(position.get(
-                    'Date'), '%Y-%m-%dT%H:%M:%S-00:00').strftime('%d %b')
+            calldate = dates[i].strftime('%d %b')
             if name[-4:].lower() == 'drop':
                 name = name[:-5]
 
@@ -214,7 +594,7 @@ def parsebvs(bvs):
             if annotation not in annots and not annotconflict(annots, annotation):
                 annots.append(annotation)
 
-    return [lons, lats, annots]
+    return [lons, lats, annots, np.array(times, dtype='datetime64[s]')]
 
 
 def parsecsv(csv):
@@ -222,7 +602,7 @@ def parsecsv(csv):
     Parse a csv file
     :param csv:
     :type csv: str
-    :return: a list of positions and annotations
+    :return: a list of positions, annotations and times
     :rtype: list
     """
     lats = []
@@ -238,49 +618,750 @@ def parsecsv(csv):
         lons.append(lon)
         if len(position) == 3:
             annots.append((lon, lat, position[2].strip()))
-    return [lons, lats, annots]
+    return [lons, lats, annots, None]
 
 
 def parseurl(url):
     """
     Parse a url
+    The first column of each position is its time. Positions are put in
+    time order, if the first column isn't a time there are no times.
     :param url:
     :type url: str
-    :return: a list of positions and annotations
+    :return: a list of positions, annotations and times
     :rtype: list
     """
     lats = []
     lons = []
     annots = []
+    times = []
 
     data = requests.get(url).json()['positions']
     positions = [line.split(',') for line in data if line]
     for position in positions:
+        times.append(position[0].strip())
         lats.append(float(position[1]))
         lons.append(float(position[2]))
 
+    try:
+        times = np.array(times, dtype='datetime64[s]')
+    except ValueError:
+        times = None
+
+    if times is not None and np.any(np.diff(times) < np.timedelta64(0)):
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        lats = [lats[i] for i in order]
+        lons = [lons[i] for i in order]
+
     annots.append((lons[0], lats[0], 'Start'))
     annots.append((lons[-1], lats[-1], 'End'))
 
-    return [lons, lats, annots]
+    return [lons, lats, annots, times]
 
 
-def annotate(m, annotations):
+def register_reader(*suffixes):
     """
-    Add anotations to the plot
-    :param m:
-    :type m: Basemap
+    Register a function as the reader for files with the given suffixes.
+    A reader takes a filename and returns lons, lats, annotations and
+    times like the parse functions do. 'http' is used for urls.
+    :param suffixes: eg 'csv', 'bvs'
+    :type suffixes: str
+    :return: A decorator
+    :rtype: function
+    """
+    def register(reader):
+        for suffix in suffixes:
+            READERS[suffix] = reader
+        return reader
+
+    return register
+
+
+def get_reader(filename):
+    """
+    Find the reader for a file, anything unknown is read as csv
+    :param filename:
+    :type filename: str
+    :return: The reader
+    :rtype: function
+    """
+    if filename[:4] == 'http':
+        return READERS['http']
+
+    return READERS.get(os.path.splitext(filename)[1][1:].lower(), readcsv)
+
+
+@register_reader('rtx')
+def readrtx(filename):
+    """
+    Read a rtx file
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parsertx(loadfile(filename))
+
+
+@register_reader('bvs')
+def readbvs(filename):
+    """
+    Read a bvs file
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parsebvs(loadfile(filename))
+
+
+@register_reader('http')
+def readurl(url):
+    """
+    Read positions from a url
+    :param url:
+    :type url: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parseurl(url)
+
+
+@register_reader('csv', 'txt')
+def readcsv(filename):
+    """
+    Read a csv file
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parsecsv(loadfile(filename))
+
+
+def parsearrays(data):
+    """
+    Take positions from arrays without copying them. data is either a
+    mapping or structured array with 'lat', 'lon' and optionally 'time'
+    columns, or a 2 dimensional array with lat, lon and optionally
+    seconds since the epoch in its columns.
+    :param data:
+    :type data: dict or numpy.ndarray
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    if isinstance(data, np.ndarray) and data.dtype.names is None:
+        lats = data[:, 0]
+        lons = data[:, 1]
+        times = data[:, 2] if data.shape[1] > 2 else None
+    else:
+        names = data.dtype.names if isinstance(data, np.ndarray) else data
+        lats = data['lat']
+        lons = data['lon']
+        times = data['time'] if 'time' in names else None
+
+    if times is not None:
+        times = np.asarray(times)
+        if not np.issubdtype(times.dtype, np.datetime64):
+            times = times.astype('datetime64[s]')
+
+    annots = [
+        (float(lons[0]), float(lats[0]), 'Start'),
+        (float(lons[-1]), float(lats[-1]), 'End')
+    ]
+
+    return [lons, lats, annots, times]
+
+
+def load_npz(filename):
+    """
+    Memory map the arrays in a npz file. np.load can't do this itself,
+    but arrays saved by np.savez are stored uncompressed, so they can
+    be mapped where they sit in the zip. Compressed arrays are read
+    into memory.
+    :param filename:
+    :type filename: str
+    :return: The arrays, keyed by name
+    :rtype: dict
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # The data follows a 30 byte local header, the file name and
+            # an extra field.
+            f.seek(info.header_offset + 26)
+            namelen, extralen = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + namelen + extralen)
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r',
+                                     shape=shape, offset=f.tell(),
+                                     order='F' if fortran else 'C')
+
+    return arrays
+
+
+@register_reader('npy')
+def readnpy(filename):
+    """
+    Read a NumPy .npy file, see parsearrays for the layout
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parsearrays(np.load(filename, mmap_mode='r'))
+
+
+@register_reader('npz')
+def readnpz(filename):
+    """
+    Read a NumPy .npz file with 'lat', 'lon' and optionally 'time' arrays
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    return parsearrays(load_npz(filename))
+
+
+@register_reader('arrow', 'feather', 'ipc')
+def readarrow(filename):
+    """
+    Read an Arrow IPC or Feather file with 'lat', 'lon' and optionally
+    'time' columns. Needs pyarrow.
+    :param filename:
+    :type filename: str
+    :return: a list of positions, annotations and times
+    :rtype: list
+    """
+    if feather is None:
+        raise ImportError('Reading ' + filename + ' needs pyarrow, '
+                          'pip install pyarrow')
+
+    table = feather.read_table(filename, memory_map=True)
+    columns = {}
+    for name in ('lat', 'lon', 'time'):
+        if name in table.column_names:
+            # A single chunk without nulls converts without a copy
+            column = table.column(name)
+            if column.num_chunks == 1:
+                column = column.chunk(0)
+            else:
+                column = column.combine_chunks()
+            columns[name] = column.to_numpy(zero_copy_only=False)
+
+    return parsearrays(columns)
+
+
+class LabelIndex:
+    """
+    A uniform grid of the boxes and points that a label must not cover.
+    Each cell lists what overlaps it, so checking a new label only looks
+    at its neighbours rather than at every label already placed.
+    """
+
+    def __init__(self, cellsize=LABEL_CELL_SIZE):
+        self.cellsize = cellsize
+        self.boxes = {}
+        self.points = {}
+
+    def cells(self, box):
+        """
+        The cells covered by a box
+        :param box: (x0, y0, x1, y1)
+        :type box: tuple
+        :return: Cell coordinates
+        :rtype: generator
+        """
+        x0, y0, x1, y1 = [int(edge // self.cellsize) for edge in box]
+        for i in range(x0, x1 + 1):
+            for j in range(y0, y1 + 1):
+                yield i, j
+
+    def add_box(self, box):
+        """
+        Add a box that later labels must avoid
+        :param box: (x0, y0, x1, y1)
+        :type box: tuple
+        """
+        for cell in self.cells(box):
+            self.boxes.setdefault(cell, []).append(box)
+
+    def add_points(self, xs, ys):
+        """
+        Add points that later labels must avoid
+        :param xs:
+        :type xs: numpy.ndarray
+        :param ys:
+        :type ys: numpy.ndarray
+        """
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            cell = (int(x // self.cellsize), int(y // self.cellsize))
+            self.points.setdefault(cell, []).append((x, y))
+
+    def collides(self, box):
+        """
+        Check a box against everything in the index
+        :param box: (x0, y0, x1, y1)
+        :type box: tuple
+        :return: True if the box overlaps a box or point in the index
+        :rtype: bool
+        """
+        x0, y0, x1, y1 = box
+        for cell in self.cells(box):
+            for bx0, by0, bx1, by1 in self.boxes.get(cell, ()):
+                if bx0 < x1 and x0 < bx1 and by0 < y1 and y0 < by1:
+                    return True
+            for px, py in self.points.get(cell, ()):
+                if x0 <= px <= x1 and y0 <= py <= y1:
+                    return True
+
+        return False
+
+
+def densify(x, y, step):
+    """
+    Add points along a line so no two are further apart than step
+    :param x:
+    :type x: numpy.ndarray
+    :param y:
+    :type y: numpy.ndarray
+    :param step:
+    :type step: float
+    :return: x and y of the points along the line
+    :rtype: tuple
+    """
+    along = np.concatenate(([0], np.cumsum(np.hypot(np.diff(x), np.diff(y)))))
+    samples = np.union1d(along, np.arange(0, along[-1], step))
+
+    return np.interp(samples, along, x), np.interp(samples, along, y)
+
+
+def label_priority(annotations):
+    """
+    The order to place labels in, labels placed first win any contest
+    for space. Positions with their own marker style (eg the current
+    position) come first, then the start and end of the route, then the
+    rest in route order. The start and end are the first and last of the
+    annotations without a marker style, as plot adds the current position
+    after them.
     :param annotations:
     :type annotations: list
+    :return: Indexes into annotations
+    :rtype: list
     """
-    for annotation in annotations:
-        x, y, = m(annotation[0], annotation[1])
-        plt.annotate(s=annotation[2], xy=(x, y),
-                     xytext=(x + 100000, y + 100000))
-        if len(annotation) == 4:
-            plt.plot(x, y, annotation[3])
+    route = [i for i, annot in enumerate(annotations) if len(annot) != 4]
+    ends = (route[0], route[-1]) if route else ()
+
+    return sorted(
+            range(len(annotations)),
+            key=lambda i: (
+                0 if len(annotations[i]) == 4 else 1 if i in ends else 2,
+                i
+            )
+    )
+
+
+def label_box(x, y, width, height, dx, dy):
+    """
+    The box covered by a label offset from a position, labels are
+    aligned so they grow away from the position.
+    :param x: Display x of the offset position
+    :type x: float
+    :param y: Display y of the offset position
+    :type y: float
+    :param width:
+    :type width: float
+    :param height:
+    :type height: float
+    :param dx: Horizontal offset
+    :type dx: float
+    :param dy: Vertical offset
+    :type dy: float
+    :return: The box and the label's horizontal and vertical alignment
+    :rtype: tuple
+    """
+    ha = 'left' if dx > 0 else 'right' if dx < 0 else 'center'
+    va = 'bottom' if dy > 0 else 'top' if dy < 0 else 'center'
+    x0 = x - {'left': 0, 'right': width, 'center': width / 2}[ha]
+    y0 = y - {'bottom': 0, 'top': height, 'center': height / 2}[va]
+
+    return (x0, y0, x0 + width, y0 + height), ha, va
+
+
+def place_legend(index, renderer, **kwargs):
+    """
+    Put the legend in the first of LEGEND_LOCATIONS where it covers
+    nothing in the index, or where legend(loc='best') puts it if it covers
+    something everywhere. Its box is added to the index so labels keep
+    off it, legend(loc='best') alone only avoids lines and patches.
+    :param index:
+    :type index: LabelIndex
+    :param renderer:
+    :param kwargs: Passed on to legend
+    :return: The legend
+    :rtype: matplotlib.legend.Legend
+    """
+    ax = plt.gca()
+    for loc in LEGEND_LOCATIONS + ['best']:
+        legend = ax.legend(loc=loc, **kwargs)
+        box = tuple(legend.get_window_extent(renderer).extents)
+        if not index.collides(box):
+            break
+
+    index.add_box(box)
+
+    return legend
+
+
+def annotate(m, route, legend=None):
+    """
+    Add the route's anotations to the plot
+    Markers are drawn with one artist per marker style. The legend, if
+    wanted, is placed next, clear of the route and the markers. Each label
+    is then tried at the offsets in LABEL_OFFSETS and put at the first one
+    where it stays on the map and doesn't cover the route, a marker, the
+    legend or another label. Labels that don't fit anywhere are dropped,
+    in the order given by label_priority.
+    :param m:
+    :type m: Basemap
+    :param route:
+    :type route: Route
+    :param legend: Keyword arguments for the legend, None for no legend
+    :type legend: dict
+    """
+    annotations = route.annotations
+
+    route.project(m)
+    ax = plt.gca()
+    renderer = ax.figure.canvas.get_renderer()
+    scale = ax.figure.dpi / 72
+    bounds = ax.get_window_extent(renderer)
+    index = LabelIndex()
+
+    styles = np.array([annot[3] if len(annot) == 4 else 'ko'
+                       for annot in annotations])
+    for style in dict.fromkeys(styles):
+        plt.plot(route.annotx[styles == style], route.annoty[styles == style],
+                 style)
+
+    # Keep labels off the markers themselves
+    points = ax.transData.transform(
+            np.column_stack((route.annotx, route.annoty)))
+    for px, py in points:
+        index.add_box((px - 3 * scale, py - 3 * scale,
+                       px + 3 * scale, py + 3 * scale))
+
+    rx, ry = ax.transData.transform(
+            np.column_stack(route.simplified())).T
+    index.add_points(*densify(rx, ry, 2 * scale))
+
+    if legend is not None:
+        place_legend(index, renderer, **legend)
+
+    for i in label_priority(annotations):
+        x, y = route.annotx[i], route.annoty[i]
+        px, py = points[i]
+        text = plt.annotate(annotations[i][2], xy=(x, y), xytext=(0, 0),
+                            textcoords='offset points')
+        extent = text.get_window_extent(renderer)
+
+        for dx, dy in LABEL_OFFSETS:
+            box, ha, va = label_box(px + dx * scale, py + dy * scale,
+                                    extent.width, extent.height, dx, dy)
+            if (bounds.x0 <= box[0] and box[2] <= bounds.x1 and
+                    bounds.y0 <= box[1] and box[3] <= bounds.y1 and
+                    not index.collides(box)):
+                index.add_box(box)
+                text.xyann = (dx, dy)
+                text.set_horizontalalignment(ha)
+                text.set_verticalalignment(va)
+                break
         else:
-            plt.plot(x, y, 'ko')
+            text.remove()
+
+
+def clip_polygon(polygon, west, south, east, north):
+    """
+    Clip a polygon to a box (Sutherland-Hodgman)
+    :param polygon: The vertices, one row per vertex
+    :type polygon: numpy.ndarray
+    :return: The vertices of the clipped polygon, may be empty
+    :rtype: numpy.ndarray
+    """
+    for axis, edge, keep in ((0, west, 1), (0, east, -1),
+                             (1, south, 1), (1, north, -1)):
+        if len(polygon) == 0:
+            break
+
+        following = np.roll(polygon, -1, axis=0)
+        inside = keep * (polygon[:, axis] - edge) >= 0
+        crosses = inside != (keep * (following[:, axis] - edge) >= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (edge - polygon[:, axis]) / (
+                    following[:, axis] - polygon[:, axis])
+            crossing = polygon + t[:, np.newaxis] * (following - polygon)
+
+        # Each edge gives its start if that is inside, then the point
+        # where it crosses the clip edge if it does.
+        polygon = np.stack((polygon, crossing), axis=1)[
+            np.column_stack((inside, crosses))]
+
+    return polygon
+
+
+def tile_pieces(coastsegs, polygons, types, tilesize=STORE_TILE_SIZE):
+    """
+    Cut coastlines and land polygons into pieces on a grid of tiles
+    :param coastsegs: Coastlines, one (lon, lat) array per line
+    :type coastsegs: list
+    :param polygons: Polygons, one (lon, lat) array per polygon
+    :type polygons: list
+    :param types: GSHHS type of each polygon, 2 and 4 are lakes
+    :type types: list
+    :param tilesize: Size of a tile in degrees
+    :type tilesize: int
+    :return: (kind, vertices) pieces for each tile, keyed by tile number
+    :rtype: dict
+    """
+    cols = 360 // tilesize
+    rows = 180 // tilesize
+    tiles = {}
+
+    def tilerange(lons, lats):
+        return (
+            range(max(int((lons.min() + 180) // tilesize), 0),
+                  min(int((lons.max() + 180) // tilesize), cols - 1) + 1),
+            range(max(int((lats.min() + 90) // tilesize), 0),
+                  min(int((lats.max() + 90) // tilesize), rows - 1) + 1)
+        )
+
+    for line in coastsegs:
+        line = np.asarray(line, dtype=float)
+        if len(line) < 2:
+            continue
+
+        # A segment goes in the tile that holds its first point, so no
+        # vertex is stored twice except where one piece joins the next.
+        # Runs of consecutive segments in a tile become one piece.
+        col = np.clip(((line[:-1, 0] + 180) // tilesize).astype(int),
+                      0, cols - 1)
+        row = np.clip(((line[:-1, 1] + 90) // tilesize).astype(int),
+                      0, rows - 1)
+        segtiles = row * cols + col
+        starts = np.flatnonzero(np.diff(segtiles)) + 1
+        for first, last in zip(np.concatenate(([0], starts)),
+                               np.concatenate((starts, [len(segtiles)]))):
+            tiles.setdefault(int(segtiles[first]), []).append(
+                    (STORE_COAST, line[first:last + 1]))
+
+    for polygon, polytype in zip(polygons, types):
+        polygon = np.asarray(polygon, dtype=float)
+        kind = STORE_LAKE if polytype in [2, 4] else STORE_LAND
+        colrange, rowrange = tilerange(polygon[:, 0], polygon[:, 1])
+        for row in rowrange:
+            for col in colrange:
+                west = col * tilesize - 180
+                south = row * tilesize - 90
+                clipped = clip_polygon(polygon, west, south,
+                                       west + tilesize, south + tilesize)
+                if len(clipped) > 2:
+                    tiles.setdefault(row * cols + col, []).append(
+                            (kind, clipped))
+
+    return tiles
+
+
+def get_store_file(store, resolution):
+    """
+    The path of the coastline store for a resolution
+    :param store: The directory holding the store
+    :type store: str
+    :param resolution: c, l, i, h or f
+    :type resolution: str
+    :return: The path
+    :rtype: str
+    """
+    return os.path.join(store, 'coast_{}.dat'.format(resolution))
+
+
+def build_store(store, resolution='i', tilesize=STORE_TILE_SIZE):
+    """
+    Split Basemap's coastlines and land polygons for a resolution into
+    tiles and save them as one flat float64 file that read_store memory
+    maps. The file holds, in order:
+        a header of STORE_HEADER values: version, tile size, columns,
+            rows, pieces, vertices, the longest coastline segment in
+            degrees of lon or lat,
+        the first piece of each tile, plus the total number of pieces,
+        the kind of each piece (STORE_COAST, STORE_LAND or STORE_LAKE),
+        the first vertex of each piece, plus the total number of vertices,
+        the lon, lat of every vertex.
+    :param store: The directory to save the store in
+    :type store: str
+    :param resolution: c, l, i, h or f
+    :type resolution: str
+    :param tilesize: Size of a tile in degrees, must divide 180
+    :type tilesize: int
+    :return: The path of the saved store
+    :rtype: str
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        world = Basemap(projection='cyl', resolution=resolution,
+                        llcrnrlon=-180, llcrnrlat=-90,
+                        urcrnrlon=180, urcrnrlat=90)
+
+    tiles = tile_pieces(
+            [np.asarray(seg) for seg in world.coastsegs],
+            [np.column_stack(poly) for poly in world.coastpolygons],
+            world.coastpolygontypes,
+            tilesize
+    )
+    cols = 360 // tilesize
+    rows = 180 // tilesize
+    pieces = [tiles.get(tile, []) for tile in range(cols * rows)]
+    tilestarts = np.cumsum([0] + [len(tile) for tile in pieces])
+    pieces = [piece for tile in pieces for piece in tile]
+    kinds = [kind for kind, _ in pieces]
+    vertexstarts = np.cumsum([0] + [len(verts) for _, verts in pieces])
+    header = np.zeros(STORE_HEADER)
+    seglength = max([
+        np.abs(np.diff(verts, axis=0)).max()
+        for kind, verts in pieces if kind == STORE_COAST
+    ] or [0])
+    header[:7] = [STORE_VERSION, tilesize, cols, rows, len(pieces),
+                  vertexstarts[-1], seglength]
+
+    os.makedirs(store, exist_ok=True)
+    filename = get_store_file(store, resolution)
+    with open(filename, 'wb') as f:
+        for block in [header, tilestarts, kinds, vertexstarts] + [
+                verts for _, verts in pieces]:
+            np.asarray(block, dtype=np.float64).tofile(f)
+
+    return filename
+
+
+def read_store(filename, west, south, east, north):
+    """
+    Read the pieces of a coastline store that cover a box. The store is
+    memory mapped and only the tiles that intersect the box are read.
+    Boxes may reach past the antimeridian, tiles from the other side are
+    shifted by 360 degrees to match.
+    A coastline segment is stored in the tile of its first point, so
+    coastlines are also read from a margin of tiles around the box wide
+    enough for the longest segment to reach into it.
+    :param filename: A store saved by build_store
+    :type filename: str
+    :return: (kind, vertices) pieces, vertices are views into the store
+             unless they had to be shifted
+    :rtype: list
+    """
+    data = np.memmap(filename, dtype=np.float64, mode='r')
+    version, tilesize, cols, rows, npieces = data[:5].astype(int)
+    margin = int(math.ceil(data[6] / tilesize))
+    if version != STORE_VERSION:
+        raise IOError('Unsupported coastline store ' + filename)
+
+    tilestarts = data[STORE_HEADER:STORE_HEADER + cols * rows + 1]
+    offset = STORE_HEADER + len(tilestarts)
+    kinds = data[offset:offset + npieces]
+    offset += npieces
+    vertexstarts = data[offset:offset + npieces + 1]
+    vertices = data[offset + npieces + 1:].reshape(-1, 2)
+
+    firstcol = int((west + 180) // tilesize)
+    lastcol = min(int((east + 180) // tilesize), firstcol + cols - 1)
+    firstrow = min(max(int((south + 90) // tilesize), 0), rows - 1)
+    lastrow = min(max(int((north + 90) // tilesize), 0), rows - 1)
+    # Don't read a tile twice when the margin wraps round the world
+    colmargin = min(margin, (cols - 1 - lastcol + firstcol) // 2)
+
+    pieces = []
+    for row in range(max(firstrow - margin, 0),
+                     min(lastrow + margin, rows - 1) + 1):
+        for col in range(firstcol - colmargin, lastcol + colmargin + 1):
+            inbox = (firstrow <= row <= lastrow and
+                     firstcol <= col <= lastcol)
+            tile = row * cols + col % cols
+            shift = (col // cols) * 360
+            for piece in range(int(tilestarts[tile]),
+                               int(tilestarts[tile + 1])):
+                if not inbox and kinds[piece] != STORE_COAST:
+                    continue
+                verts = vertices[int(vertexstarts[piece]):
+                                 int(vertexstarts[piece + 1])]
+                if shift:
+                    verts = verts + (shift, 0)
+                pieces.append((int(kinds[piece]), verts))
+
+    return pieces
+
+
+def drawstore(m, pieces, color, coastcolor, linewidth, landzorder=None,
+              coastzorder=None):
+    """
+    Draw coastlines and fill continents from a coastline store, as
+    Basemap's drawcoastlines and fillcontinents would.
+    :param m:
+    :type m: Basemap
+    :param pieces: Pieces from read_store
+    :type pieces: list
+    :param color: Colour of the land
+    :type color: str
+    :param coastcolor: Colour of the coastline
+    :type coastcolor: str
+    :param linewidth: Width of the coastline
+    :type linewidth: float
+    :param landzorder:
+    :type landzorder: float
+    :param coastzorder:
+    :type coastzorder: float
+    """
+    ax = plt.gca()
+    if not pieces:
+        m.set_axes_limits(ax=ax)
+        return
+
+    # Project every vertex in one go, then split back into pieces
+    lonlat = np.concatenate([verts for _, verts in pieces])
+    x, y = m(lonlat[:, 0], lonlat[:, 1])
+    projected = np.split(np.column_stack((x, y)),
+                         np.cumsum([len(verts) for _, verts in pieces])[:-1])
+
+    # Land goes in as one patch per piece, like fillcontinents, so that
+    # legend(loc='best') still sees it and keeps clear
+    background = ax.get_facecolor()
+    for (kind, _), verts in zip(pieces, projected):
+        if kind == STORE_COAST:
+            continue
+        fill = background if kind == STORE_LAKE else color
+        land = Polygon(verts, facecolor=fill, edgecolor=fill, linewidth=0)
+        if landzorder is not None:
+            land.set_zorder(landzorder)
+        ax.add_patch(land)
+
+    coast = LineCollection(
+            [verts for (kind, _), verts in zip(pieces, projected)
+             if kind == STORE_COAST],
+            colors=coastcolor,
+            linewidths=linewidth
+    )
+    if coastzorder is not None:
+        coast.set_zorder(coastzorder)
+    ax.add_collection(coast)
+    m.set_axes_limits(ax=ax)
 
 
 def get_current_position(posstr):
@@ -341,13 +1422,17 @@ def plot(
         quality='i',
         paper='a3',
         dpi=600,
+        start=None,
+        end=None,
+        rasterdpi=None,
+        store=None,
 ):
     """
 
     :param currposlabel:
     :type currposlabel:
-    :param filename:
-    :type filename: str
+    :param filename: A file or url, or arrays as taken by parsearrays
+    :type filename: str or dict or numpy.ndarray
     :param currpos:
     :type currpos: str
     :param output:
@@ -362,32 +1447,70 @@ def plot(
     :type endtag: str
     :param quality:
     :type quality: str
+    :param start: Only plot positions from this time onwards
+    :type start: str or datetime.datetime
+    :param end: Only plot positions up to this time
+    :type end: str or datetime.datetime
+    :param rasterdpi: Rasterise coastlines and land into one image at this
+                      resolution, for compact svg, pdf and eps output
+    :type rasterdpi: int
+    :param store: Directory of coastline stores made by build_store, only
+                  the part of the coastline that is on the map is read
+    :type store: str
     """
     annotations = []
+    eta = None
 
-    if filename[-3:] == 'rtx':
-        lons, lats, title = parsertx(loadfile(filename))
-    elif filename[-3:] == 'bvs':
-        lons, lats, annots = parsebvs(loadfile(filename))
-    elif filename[:4] == 'http':
-        lons, lats, annots = parseurl(filename)
+    if isinstance(filename, str):
+        name = os.path.splitext(filename)[0]
+        lons, lats, annots, times = get_reader(filename)(filename)
     else:
-        lons, lats, annots = parsecsv(loadfile(filename))
+        name = 'routemap'
+        lons, lats, annots, times = parsearrays(filename)
+
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+
+    if start or end:
+        if times is None:
+            raise ValueError('The route has no times to take a window from')
+
+        window = get_window(
+                times,
+                np.datetime64(start, 's') if start else None,
+                np.datetime64(end, 's') if end else None
+        )
+        if window.start >= window.stop:
+            raise ValueError('No positions between {} and {}'.format(
+                    start, end))
+
+        if window.stop < len(times):
+            eta = get_eta(lats, lons, times, upto=window.stop - 1)
+
+        # Only keep annotations for positions inside the window
+        annots = [
+            annot for annot, index
+            in zip(annots, get_annotation_indexes(lons, lats, annots))
+            if window.start <= index < window.stop
+        ]
+        # Basic slicing gives views, so the rest of the track isn't copied
+        lons, lats, times = lons[window], lats[window], times[window]
 
     if len(annots) > 0:
         for annotation in annots:
             annotations.append(annotation)
 
-    if starttag:
+    # A time window may leave no annotations to tag
+    if starttag and annotations:
         annotations[0] = (annotations[0][0], annotations[0][1], starttag)
 
-    if endtag:
+    if endtag and annotations:
         annotations[-1] = (annotations[-1][0], annotations[-1][1], endtag)
 
     if custtitle:
         title = custtitle
     else:
-        title = filename[:-4]
+        title = name
 
     if currpos:
         currpos = get_current_position(currpos)
@@ -395,7 +1518,22 @@ def plot(
         currlon = float(currpos[1])
         annotations.append((currlon, currlat, currposlabel, 'bo'))
 
+    route = Route(lons, lats, annotations, times)
     totaldistance = calcdistance(lats, lons)
+    label = 'Distance = ' + '{:,}'.format(
+            int(totaldistance / KM_IN_NM)
+    ) + ' NM'
+
+    if times is not None and len(times) > 1:
+        speed = average_speed(lats, lons, times)
+        if not math.isnan(speed):
+            label += '\nAverage speed = {:.1f} kn'.format(speed)
+            label += '\nTime at sea = ' + format_duration(
+                    time_at_sea(lats, lons, times))
+
+    if eta is not None and not np.isnat(eta):
+        label += '\nETA = ' + eta.astype(datetime.datetime).strftime(
+                '%d %b %H:%M')
     north = int(max(lats))
     south = int(min(lats))
     west = int(min(lons))
@@ -413,13 +1551,34 @@ def plot(
     if quality not in ['c', 'l', 'i', 'h', 'f']:
         quality = 'i'
 
+    storefile = None
+    if store:
+        storefile = get_store_file(store, quality)
+        if not os.path.isfile(storefile):
+            raise IOError('No coastline store at ' + storefile +
+                          ', build it with --build-store')
+
+    if output:
+        outfile = output
+    else:
+        outfile = name + '.png'
+
+    if rasterdpi and (os.path.splitext(outfile)[1][1:].lower()
+                      not in VECTOR_FORMATS):
+        warnings.warn('rasterdpi only applies to ' + ', '.join(
+                VECTOR_FORMATS) + ' output, ignoring it for ' + outfile)
+        rasterdpi = None
+
+    savedpi = rasterdpi or dpi
+
     # Fixing warnings would be better than suppressing them, but, hey ho, this
     # works for now. ;)
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         earth = Basemap(
                 projection='merc',
-                resolution=quality,
+                # Boundaries come from the store instead, if there is one
+                resolution=None if storefile else quality,
                 lat_0=midlat,
                 lon_0=midlon,
                 # longitude of lower left hand corner of the desired map domain
@@ -436,37 +1595,49 @@ def plot(
                 urcrnrlat=north
         )
 
-        plt.figure(figsize=(16, 10))
-        earth.drawcoastlines(color='0.50', linewidth=0.25)
+        fig = plt.figure(figsize=(16, 10))
+        ax = fig.gca()
+        landzorder = coastzorder = None
+        if rasterdpi:
+            ax.set_rasterization_zorder(BACKGROUND_ZORDER)
+            landzorder = BACKGROUND_ZORDER - 2
+            coastzorder = BACKGROUND_ZORDER - 1
+
+        if storefile:
+            drawstore(earth, read_store(storefile, west, south, east, north),
+                      '0.95', '0.50', 0.25, landzorder, coastzorder)
+        else:
+            earth.drawcoastlines(color='0.50', linewidth=0.25,
+                                 zorder=coastzorder)
         earth.drawparallels(getcardinals(south, north, 10),
                             labels=[1, 0, 0, 1], color='0.75')
         earth.drawmeridians(getcardinals(west, east, 10),
                             labels=[1, 0, 0, 1], color='0.75')
 
         # earth.shadedrelief()
-        earth.fillcontinents(color='0.95')
+        if not storefile:
+            earth.fillcontinents(color='0.95', zorder=landzorder)
+
+        # Drop route points that are closer together than a pixel of the
+        # saved image, they only bloat vector output.
+        resolution = savedpi or plt.rcParams['savefig.dpi']
+        if resolution == 'figure':
+            resolution = fig.dpi
+        ax.apply_aspect()
+        pixels = ax.get_position().width * fig.get_figwidth() * resolution
+        x, y = route.project(earth).simplify(
+                (earth.urcrnrx - earth.llcrnrx) / pixels / 2).simplified()
         earth.plot(
-                lons,
-                lats,
+                x,
+                y,
                 'r',
                 linewidth=1,
-                latlon=True,
-                label='Distance = ' + '{:,}'.format(
-                        int(totaldistance / KM_IN_NM)
-                ) + ' NM'
+                label=label
         )
 
-        annotate(earth, annotations)
-
-        plt.subplot(1, 1, 1)
-        plt.legend(loc='best', frameon=True)
+        annotate(earth, route, legend={'frameon': True})
         plt.title(title)
 
-        if output:
-            outfile = output
-        else:
-            outfile = filename[:-4] + '.png'
-
         if cli:
             sys.stdout.write('Saved image to ' + outfile + '\n')
 
@@ -474,7 +1645,7 @@ def plot(
                 outfile,
                 bbox_inches='tight',
                 papertype=paper,
-                dpi=dpi
+                dpi=savedpi
         )
         if display:
             plt.show()
@@ -511,7 +1682,11 @@ def routemap():
     parser.add_argument(
             'file',
             type=str,
-            help='Input file. rtx or bvs files accepted.'
+            nargs='?',
+            help="""
+        Input file or url. csv, rtx, bvs, npy, npz and Arrow/Feather\n
+        (arrow, feather, ipc) files accepted.
+        """
     )
 
     parser.add_argument(
@@ -593,6 +1768,37 @@ def routemap():
         """
     )
 
+    parser.add_argument(
+            '--raster-dpi',
+            type=int,
+            help="""
+        Rasterise the coastlines and land at this DPI and keep the route,\n
+        labels and grid as vectors. Use with svg, pdf or eps output for\n
+        much smaller files at h or f quality, eg:-\n
+        -o route.pdf -q f --raster-dpi 300
+        """
+    )
+
+    parser.add_argument(
+            '--store',
+            type=str,
+            help="""
+        Directory of tiled coastline stores. Only the tiles on the map are\n
+        read, which is much faster than loading the whole coastline at h\n
+        or f quality.
+        """
+    )
+
+    parser.add_argument(
+            '--build-store',
+            action='store_true',
+            help="""
+        Build the coastline store for the quality given with -q in the\n
+        directory given with --store, then exit, eg:-\n
+        --build-store --store ~/.routemap -q f
+        """
+    )
+
     parser.add_argument(
             '--paper',
             type=str,
@@ -603,6 +1809,28 @@ def routemap():
         """
     )
 
+    parser.add_argument(
+            '--from',
+            dest='start',
+            type=str,
+            help="""
+        Only plot positions from this time onwards, eg:-\n
+        --from 2017-07-25T06:00\n
+        Needs a source with times, such as a bvs file or url
+        """
+    )
+
+    parser.add_argument(
+            '--to',
+            dest='end',
+            type=str,
+            help="""
+        Only plot positions up to this time, eg:-\n
+        --to 2017-07-26\n
+        The ETA at the final waypoint is shown if the track is cut short
+        """
+    )
+
     parser.add_argument(
             '--version',
             action='version',
@@ -612,6 +1840,16 @@ def routemap():
 
     args = parser.parse_args()
 
+    if args.build_store:
+        if not args.store:
+            parser.error('--build-store needs --store')
+        sys.stdout.write('Saved coastline store to ' + build_store(
+                args.store, args.quality or 'i') + '\n')
+        return
+
+    if not args.file:
+        parser.error('the following arguments are required: file')
+
     plot(
             args.file,
             currpos=args.current,
@@ -624,6 +1862,10 @@ def routemap():
             quality=args.quality,
             paper=args.paper,
             dpi=args.dpi,
+            start=args.start,
+            end=args.end,
+            rasterdpi=args.raster_dpi,
+            store=args.store,
     )
 
 
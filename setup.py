@@ -11,7 +11,6 @@ requires = [
     'matplotlib',
     'Pillow',
     'requests',
-    'vincenty',
     'geographiclib'
 ]
 
@@ -42,5 +41,8 @@ setup(
     test_suite="tests",
     package_dir={'routemap': 'routemap'},
     install_requires=requires,
+    extras_require={
+        'arrow': ['pyarrow']
+    },
     packages=packages
 )
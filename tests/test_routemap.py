@@ -2,13 +2,26 @@
 Tests for routemap package
 """
 import json
+import mmap
+import os
+import tempfile
 import unittest
+
+import numpy as np
+import matplotlib.pyplot as plt
+from mpl_toolkits.basemap import Basemap
 from unittest.mock import MagicMock
 from unittest.mock import patch
 
 from routemap import routemap
 from requests import Response
 
+try:
+    import pyarrow
+    from pyarrow import feather
+except ImportError:
+    pyarrow = None
+
 
 class TestRoutemap(unittest.TestCase):
 
@@ -63,11 +76,141 @@ class TestRoutemap(unittest.TestCase):
             json=MagicMock(return_value=test_positions)
         )
 
-        lons, lats, annots = routemap.parseurl(test_url)
+        lons, lats, annots, times = routemap.parseurl(test_url)
 
         self.assertEqual(test_lons, lons)
         self.assertEqual(test_lats, lats)
         self.assertEqual(test_annots, annots)
+        self.assertEqual(np.datetime64('2017-07-24T00:59:58'), times[0])
+        self.assertEqual(np.datetime64('2017-07-24T04:59:58'), times[-1])
+
+    def test_can_calculate_distance(self):
+        boston = (42.3541165, -71.0693514)
+        newyork = (40.7791472, -73.9680804)
+
+        distances = routemap.vincenty_distances(
+                [0, 0, 0, boston[0], newyork[0]],
+                [0, 1, 1, boston[1], newyork[1]]
+        )
+
+        self.assertEqual(111.319491, distances[0])
+        self.assertEqual(0, distances[1])
+        self.assertEqual(298.396057, distances[3])
+        # Nearly antipodal, Vincenty fails to converge
+        self.assertTrue(np.isnan(
+                routemap.vincenty_distances([0, 0.5], [0, 179.7])[0]))
+        self.assertEqual(111.319491 * 2,
+                         routemap.calcdistance([0, 0, 0], [0, 1, 2]))
+
+    def test_can_get_track_analytics(self):
+        lats = [0, 0, 1, 1]
+        lons = [0, 1, 1, 1]
+        times = np.array([
+            '2017-07-24T00:00', '2017-07-24T06:00',
+            '2017-07-24T10:00', '2017-07-24T12:00'
+        ], dtype='datetime64[s]')
+
+        speeds = routemap.leg_speeds(lats, lons, times)
+        self.assertAlmostEqual(10.0, speeds[0], places=0)
+        self.assertAlmostEqual(15.0, speeds[1], places=0)
+        self.assertEqual(0, speeds[2])
+        self.assertEqual(np.timedelta64(10, 'h'),
+                         routemap.time_at_sea(lats, lons, times))
+        self.assertAlmostEqual(12.0, routemap.average_speed(lats, lons, times),
+                               places=0)
+
+        self.assertEqual('0d 10h', routemap.format_duration(
+                routemap.time_at_sea(lats, lons, times)))
+        self.assertEqual('2d 00h', routemap.format_duration(
+                np.timedelta64(47 * 60 + 42, 'm')))
+
+        eta = routemap.get_eta(lats, lons, times, upto=1)
+        self.assertLess(abs(eta - np.datetime64('2017-07-24T12:00')),
+                        np.timedelta64(10, 'm'))
+
+    @patch('matplotlib.pyplot.savefig')
+    def test_time_window_keeps_annotations_inside_it(self, mock_plot):
+        with open('tests/test.bvs') as bvsf:
+            lons, lats, annots, times = routemap.parsebvs(bvsf.read())
+        window = routemap.get_window(times, np.datetime64('2017-07-29'))
+        indexes = routemap.get_annotation_indexes(
+                np.asarray(lons), np.asarray(lats), annots)
+
+        self.assertEqual(0, indexes[0])
+        self.assertEqual([False, True],
+                         [window.start <= i < window.stop for i in indexes])
+
+        # Nothing to tag in this window, so the tags are skipped
+        routemap.plot('./tests/test.bvs', start='2017-07-25',
+                      end='2017-07-26', starttag='X', endtag='Y',
+                      quality='c')
+        plt.close('all')
+
+    @patch('matplotlib.pyplot.savefig')
+    def test_eta_is_shown_when_track_is_cut_short(self, mock_plot):
+        # The last leg before the end of the window is longer than the
+        # 6 hours get_eta looks back over.
+        routemap.plot('./tests/test.bvs', end='2017-07-27', quality='c')
+
+        legend = [text.get_text()
+                  for text in plt.gca().get_legend().get_texts()]
+        plt.close('all')
+        self.assertIn('ETA', legend[0])
+
+    def test_can_get_time_window(self):
+        with open('tests/test.bvs') as bvsf:
+            lons, lats, annots, times = routemap.parsebvs(bvsf.read())
+
+        self.assertEqual(len(lats), len(times))
+        self.assertTrue(np.all(np.diff(times) >= np.timedelta64(0)))
+
+        window = routemap.get_window(
+                times,
+                np.datetime64('2017-07-25T00:00'),
+                np.datetime64('2017-07-26T00:00')
+        )
+        self.assertTrue(np.all(times[window] >= np.datetime64('2017-07-25')))
+        self.assertTrue(np.all(times[window] <= np.datetime64('2017-07-26')))
+        self.assertTrue(times[window.start - 1] < np.datetime64('2017-07-25'))
+        self.assertTrue(times[window.stop] > np.datetime64('2017-07-26'))
+
+        with self.assertRaises(ValueError):
+            routemap.get_window(times[::-1], np.datetime64('2017-07-25'))
+
+    @patch('requests.get')
+    def test_url_positions_are_put_in_time_order(self, mock_requests):
+        mock_requests.return_value = MagicMock(
+            spec=Response,
+            status_code=200,
+            json=MagicMock(return_value={'positions': [
+                '2017-07-24 02:00:00,9.005,-79.6',
+                '2017-07-24 00:59:58,8.996,-79.591',
+                '2017-07-24 02:59:55,9.017,-79.613'
+            ]})
+        )
+
+        lons, lats, annots, times = routemap.parseurl('http://any.url')
+
+        self.assertEqual([8.996, 9.005, 9.017], lats)
+        self.assertEqual([-79.591, -79.6, -79.613], lons)
+        self.assertEqual((-79.591, 8.996, 'Start'), annots[0])
+        self.assertTrue(np.all(np.diff(times) > np.timedelta64(0)))
+
+    @patch('requests.get')
+    def test_url_positions_without_times(self, mock_requests):
+        mock_requests.return_value = MagicMock(
+            spec=Response,
+            status_code=200,
+            json=MagicMock(return_value={'positions': [
+                'MMSI 123,8.996,-79.591',
+                'MMSI 123,9.005,-79.6'
+            ]})
+        )
+
+        lons, lats, annots, times = routemap.parseurl('http://any.url')
+
+        self.assertEqual([8.996, 9.005], lats)
+        self.assertIsNone(times)
 
     def test_can_get_padding(self):
 
@@ -83,6 +226,311 @@ class TestRoutemap(unittest.TestCase):
             test_n, test_s, test_w, test_e, test_padding = position
             self.assertEqual(routemap.get_padding(test_n, test_s, test_w, test_e), test_padding)
 
+    @patch('matplotlib.pyplot.savefig')
+    def test_can_rasterise_background(self, mock_plot):
+        routemap.plot('./tests/test.bvs', output='./tests/test.svg',
+                      quality='c', dpi=300, rasterdpi=50)
+
+        ax = plt.gca()
+        background = ax.collections + ax.patches
+        route = [line for line in ax.lines
+                 if line.get_label().startswith('Distance')]
+        plt.close('all')
+
+        self.assertEqual(routemap.BACKGROUND_ZORDER,
+                         ax.get_rasterization_zorder())
+        self.assertTrue(background)
+        for artist in background:
+            self.assertLess(artist.get_zorder(), routemap.BACKGROUND_ZORDER)
+        self.assertEqual(1, len(route))
+        self.assertGreaterEqual(route[0].get_zorder(),
+                                routemap.BACKGROUND_ZORDER)
+        self.assertFalse(route[0].get_rasterized())
+        self.assertEqual(50, mock_plot.call_args[1]['dpi'])
+
+    @patch('matplotlib.pyplot.savefig')
+    def test_raster_dpi_is_ignored_for_png(self, mock_plot):
+        with self.assertWarns(UserWarning):
+            routemap.plot('./tests/test.bvs', output='./tests/test.png',
+                          quality='c', dpi=300, rasterdpi=50)
+
+        self.assertIsNone(plt.gca().get_rasterization_zorder())
+        plt.close('all')
+        self.assertEqual(300, mock_plot.call_args[1]['dpi'])
+
+    def test_can_simplify_route(self):
+        x = np.array([0, 1, 2, 3, 4, 5, 6], dtype=float)
+        y = np.array([0, 0.01, 0, 0, 3, 0.01, 0])
+
+        keep = routemap.simplify(x, y, 0.1)
+
+        self.assertEqual([True, False, False, True, True, True, True],
+                         keep.tolist())
+        self.assertTrue(routemap.simplify(x, y, 0).all())
+
+    def test_can_get_label_priority(self):
+        annotations = [
+            (0, 0, 'Start'),
+            (1, 1, 'Port'),
+            (2, 2, 'End'),
+            (1.5, 1.5, 'Current Position', 'bo')
+        ]
+
+        self.assertEqual([3, 0, 2, 1], routemap.label_priority(annotations))
+        self.assertEqual([0, 2, 1],
+                         routemap.label_priority(annotations[:3]))
+
+    def test_labels_do_not_overlap(self):
+        plt.figure(figsize=(4, 4))
+        plt.xlim(0, 10)
+        plt.ylim(0, 10)
+        annotations = [
+            (pos, pos, 'Port {}'.format(pos)) for pos in np.arange(1, 9, 0.25)
+        ]
+        annotations.append((5, 5.1, 'Current Position', 'bo'))
+        route = routemap.Route(np.linspace(0, 10, 50), np.linspace(0, 10, 50),
+                               annotations)
+
+        routemap.annotate(lambda lon, lat: (lon, lat), route)
+
+        ax = plt.gca()
+        renderer = ax.figure.canvas.get_renderer()
+        boxes = [text.get_window_extent(renderer) for text in ax.texts]
+        labels = [text.get_text() for text in ax.texts]
+        markers = len(ax.lines)
+        plt.close()
+
+        self.assertEqual(2, markers)
+        self.assertIn('Current Position', labels)
+        self.assertIn('Port 1.0', labels)
+        self.assertLess(len(labels), len(annotations))
+        for i, box in enumerate(boxes):
+            for other in boxes[i + 1:]:
+                self.assertFalse(box.overlaps(other))
+
+    def test_can_clip_polygon(self):
+        square = np.array([[0, 0], [4, 0], [4, 4], [0, 4]], dtype=float)
+
+        clipped = routemap.clip_polygon(square, 2, -1, 6, 2)
+
+        self.assertEqual({(2, 0), (4, 0), (4, 2), (2, 2)},
+                         {tuple(vertex) for vertex in clipped.tolist()})
+        self.assertEqual(0, len(routemap.clip_polygon(square, 5, 5, 6, 6)))
+
+    def test_coastlines_are_not_stored_twice(self):
+        line = np.array([[1, 1], [4, 1], [6, 1], [9, 1], [11, 1]], float)
+
+        tiles = routemap.tile_pieces([line], [], [], tilesize=5)
+        pieces = [verts.tolist() for tile in sorted(tiles)
+                  for _, verts in tiles[tile]]
+
+        self.assertEqual([
+            [[1, 1], [4, 1], [6, 1]],
+            [[6, 1], [9, 1], [11, 1]]
+        ], pieces)
+
+    def test_can_read_coastline_store(self):
+        def land(pieces):
+            return np.concatenate([verts for kind, verts in pieces
+                                   if kind != routemap.STORE_COAST])
+
+        with tempfile.TemporaryDirectory() as store:
+            filename = routemap.build_store(store, 'c')
+            self.assertEqual(os.path.join(store, 'coast_c.dat'), filename)
+
+            pieces = routemap.read_store(filename, -82, 8, -78, 12)
+            kinds = {kind for kind, _ in pieces}
+            vertices = land(pieces)
+
+            self.assertIn(routemap.STORE_COAST, kinds)
+            self.assertIn(routemap.STORE_LAND, kinds)
+            self.assertTrue(np.all(vertices[:, 0] >= -85))
+            self.assertTrue(np.all(vertices[:, 0] <= -75))
+            self.assertEqual([], [
+                kind for kind, _ in routemap.read_store(
+                        filename, -30, -5, -25, 0)
+                if kind != routemap.STORE_COAST
+            ])
+
+            # Past the antimeridian Alaska comes back east of 180
+            vertices = land(routemap.read_store(filename, 170, 55, 215, 70))
+            self.assertTrue(np.any(vertices[:, 0] > 200))
+            self.assertTrue(np.all(vertices[:, 0] >= 170))
+
+    def test_store_has_every_coastline_segment_on_the_map(self):
+        west, south, east, north = -85, 5, -60, 45
+        world = Basemap(projection='cyl', resolution='c',
+                        llcrnrlon=-180, llcrnrlat=-90,
+                        urcrnrlon=180, urcrnrlat=90)
+
+        def segments(lines):
+            found = set()
+            for line in lines:
+                line = np.asarray(line, dtype=float)
+                for start, end in zip(line[:-1].tolist(), line[1:].tolist()):
+                    if (min(start[0], end[0]) <= east and
+                            max(start[0], end[0]) >= west and
+                            min(start[1], end[1]) <= north and
+                            max(start[1], end[1]) >= south):
+                        found.add((tuple(start), tuple(end)))
+            return found
+
+        with tempfile.TemporaryDirectory() as store:
+            filename = routemap.build_store(store, 'c')
+            pieces = routemap.read_store(filename, west, south, east, north)
+
+        expected = segments(world.coastsegs)
+        self.assertIn(((-85.02, 15.99), (-83.39, 15.25)), {
+            (tuple(np.round(start, 2)), tuple(np.round(end, 2)))
+            for start, end in expected
+        })
+        self.assertEqual(set(), expected - segments(
+                [verts for kind, verts in pieces
+                 if kind == routemap.STORE_COAST]))
+
+    @patch('matplotlib.pyplot.savefig')
+    def test_legend_keeps_off_labels_and_markers(self, mock_plot):
+        with tempfile.TemporaryDirectory() as store:
+            routemap.build_store(store, 'c')
+            routemap.plot('./tests/test.bvs', quality='c', store=store)
+
+        ax = plt.gca()
+        renderer = ax.figure.canvas.get_renderer()
+        legend = ax.get_legend().get_window_extent(renderer)
+        labels = [text.get_window_extent(renderer) for text in ax.texts
+                  if '(' in text.get_text()]
+        markers = ax.transData.transform(ax.lines[-1].get_xydata())
+        patches = len(ax.patches)
+        plt.close('all')
+
+        self.assertGreater(patches, 0)
+        self.assertEqual(2, len(labels))
+        for box in labels:
+            self.assertFalse(legend.overlaps(box))
+        for x, y in markers:
+            self.assertFalse(legend.contains(x, y))
+
+    def test_can_read_binary_positions(self):
+        lats = np.array([8.996, 9.005, 9.017])
+        lons = np.array([-79.591, -79.6, -79.613])
+        times = np.array(['2017-07-24T01:00', '2017-07-24T02:00',
+                          '2017-07-24T03:00'], dtype='datetime64[s]')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            npy = os.path.join(tmp, 'track.npy')
+            np.save(npy, np.column_stack((lats, lons)))
+            npz = os.path.join(tmp, 'track.npz')
+            np.savez(npz, lat=lats, lon=lons, time=times)
+
+            self.assertIs(routemap.readnpy, routemap.get_reader(npy))
+            self.assertIs(routemap.readcsv,
+                          routemap.get_reader('./tests/track.pos'))
+
+            for filename in (npy, npz):
+                rlons, rlats, annots, rtimes = routemap.get_reader(
+                        filename)(filename)
+                # Views all the way down to the mapped file, no copies
+                base = rlats
+                while isinstance(base, np.ndarray):
+                    base = base.base
+                self.assertIsInstance(base, mmap.mmap)
+                self.assertEqual(lats.tolist(), rlats.tolist())
+                self.assertEqual(lons.tolist(), rlons.tolist())
+                self.assertEqual((-79.591, 8.996, 'Start'), annots[0])
+
+            self.assertEqual(times.tolist(), rtimes.tolist())
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_can_read_arrow_positions(self):
+        table = pyarrow.table({
+            'lat': [8.996, 9.005],
+            'lon': [-79.591, -79.6],
+            'time': pyarrow.array([1500858000, 1500861600],
+                                  pyarrow.timestamp('s'))
+        })
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'track.feather')
+            feather.write_feather(table, filename, compression='uncompressed')
+
+            lons, lats, annots, times = routemap.readarrow(filename)
+
+        self.assertEqual([8.996, 9.005], lats.tolist())
+        self.assertEqual([-79.591, -79.6], lons.tolist())
+        self.assertEqual(np.datetime64('2017-07-24T01:00'), times[0])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    @patch('matplotlib.pyplot.savefig')
+    def test_can_plot_arrow_positions(self, mock_plot):
+        table = pyarrow.table({
+            'lat': [9.5541, 11.1833, 14.2660],
+            'lon': [-79.9454, -80.1833, -80.6326]
+        })
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'track.feather')
+            feather.write_feather(table, filename, compression='uncompressed')
+
+            routemap.plot(filename, quality='c', dpi=100)
+
+        title = plt.gca().get_title()
+        plt.close('all')
+        self.assertEqual(os.path.join(tmp, 'track'), title)
+        self.assertEqual(os.path.join(tmp, 'track.png'),
+                         mock_plot.call_args[0][0])
+
+    @patch('matplotlib.pyplot.savefig')
+    def test_can_plot_arrays(self, mock_plot):
+        lats = np.array([9.5541, 11.1833, 14.2660])
+        lons = np.array([-79.9454, -80.1833, -80.6326])
+
+        routemap.plot({'lat': lats, 'lon': lons}, quality='c', dpi=100)
+
+        mock_plot.assert_called_with(
+            'routemap.png',
+            bbox_inches='tight',
+            dpi=100,
+            papertype='a3')
+
+        # Plain lists from in-memory callers, times in epoch seconds
+        routemap.plot({
+            'lat': lats.tolist(),
+            'lon': lons.tolist(),
+            'time': [1500858000, 1500878640, 1500940230]
+        }, quality='c', dpi=100)
+
+        legend = plt.gca().get_legend().get_texts()[0].get_text()
+        plt.close('all')
+        self.assertIn('Average speed', legend)
+
+    def test_route_is_projected_once(self):
+        projection = MagicMock(side_effect=lambda lons, lats: (lons * 2,
+                                                               lats * 3))
+        route = routemap.Route([1, 2, 3], [4, 5, 6],
+                               [(1, 4, 'Start'), (3, 6, 'End', 'bo')])
+
+        route.project(projection)
+        route.project(projection)
+
+        self.assertEqual(1, projection.call_count)
+        self.assertEqual([2, 4, 6], route.x.tolist())
+        self.assertEqual([12, 15, 18], route.y.tolist())
+        self.assertEqual([2, 6], route.annotx.tolist())
+        self.assertEqual([12, 18], route.annoty.tolist())
+
+    def test_route_keeps_simplified_positions(self):
+        route = routemap.Route([0, 1, 2, 3], [0, 0.01, 0, 0], [])
+
+        route.project(lambda lons, lats: (lons, lats))
+        self.assertEqual(4, len(route.simplified()[0]))
+
+        keep = route.simplify(0.1).keep
+        self.assertIs(keep, route.simplify(0.1).keep)
+        self.assertEqual([0, 3], route.simplified()[0].tolist())
+
+        route.project(lambda lons, lats: (lons * 2, lats))
+        self.assertIsNone(route.keep)
+
 
 if __name__ == '__main__':
     unittest.main()